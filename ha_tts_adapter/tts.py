@@ -9,36 +9,52 @@
 # pylance: disable=reportMissingImports, reportMissingModuleSource
 # mypy: disable-error-code="import-untyped, import-not-found"
 
+import asyncio
 import logging
+import re
 from typing import Any, Dict, List, Optional, Tuple
 from urllib.parse import quote
 
 import requests
+from requests.adapters import HTTPAdapter
 import voluptuous as vol
 
 from homeassistant.components.tts import PLATFORM_SCHEMA, Provider # type: ignore
-from homeassistant.const import CONF_TIMEOUT # type: ignore
+from homeassistant.const import CONF_TIMEOUT, EVENT_HOMEASSISTANT_STOP # type: ignore
 import homeassistant.helpers.config_validation as cv # type: ignore
 from homeassistant.helpers.aiohttp_client import async_get_clientsession # type: ignore
 from aiohttp import ClientTimeout # type: ignore
 
 CONF_BASE_URL = "base_url"
 CONF_FORMAT = "format"
+CONF_MAX_CONCURRENT = "max_concurrent"
 
 DEFAULT_TIMEOUT = 30
 DEFAULT_FORMAT = "mp3"
+DEFAULT_MAX_CONCURRENT = 2
 
 _LOGGER = logging.getLogger(__name__)
 
+# Messages made only of unreserved ASCII characters (plus spaces) need no full percent-encoding pass
+_SAFE_RE = re.compile(r"[A-Za-z0-9._~ -]*")
+
 PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
     {
         vol.Required(CONF_BASE_URL): cv.string,
         vol.Optional(CONF_TIMEOUT, default=DEFAULT_TIMEOUT): cv.positive_int,
         vol.Optional(CONF_FORMAT, default=DEFAULT_FORMAT): vol.In(["mp3"]),
+        vol.Optional(CONF_MAX_CONCURRENT, default=DEFAULT_MAX_CONCURRENT): cv.positive_int,
     }
 )
 
 
+def _encode_message(message: str) -> str:
+    """Percent-encode message for use as a URL path segment."""
+    if message.isascii() and _SAFE_RE.fullmatch(message):
+        return message.replace(" ", "%20")
+    return quote(message, safe="")
+
+
 def get_engine(hass: Any, config: Dict[str, Any], discovery_info: Optional[Dict[str, Any]] = None):
     """Return TTS provider instance."""
     _ = discovery_info
@@ -54,9 +70,27 @@ class HaTtsAdapterProvider(Provider):
         self._lang: str = "ru"
         self._supported_languages: List[str] = ["ru", "ru-ru", "en", "en-us"]
         self._base_url: str = str(config.get(CONF_BASE_URL, "")).rstrip("/")
+        self._synth_prefix: str = self._base_url + "/synthesize/"
         self._timeout: int = int(config.get(CONF_TIMEOUT, DEFAULT_TIMEOUT))
         self._format: str = str(config.get(CONF_FORMAT, DEFAULT_FORMAT))
+        self._max_concurrent: int = int(config.get(CONF_MAX_CONCURRENT, DEFAULT_MAX_CONCURRENT))
+        # Created lazily in async_get_tts_audio, bound to HA's event loop
+        self._sem: Optional[asyncio.Semaphore] = None
         # Do NOT create aiohttp session here; get_engine runs in executor without a running loop
+        # Timeout and headers are plain objects, safe to build without a loop and reuse per request
+        self._aio_timeout = ClientTimeout(total=self._timeout)
+        self._aio_headers: Dict[str, str] = {"Accept": "audio/mpeg"}
+
+        # Persistent requests session for the sync path: keep-alive + connection pooling to the TTS server
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=10, max_retries=0)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._session.headers.update({"Accept": "audio/mpeg", "Connection": "keep-alive"})
+        hass.bus.listen_once(EVENT_HOMEASSISTANT_STOP, self._close_session)
+
+    def _close_session(self, _event: Any = None) -> None:
+        self._session.close()
 
     @property
     def default_language(self) -> str:
@@ -85,35 +119,46 @@ class HaTtsAdapterProvider(Provider):
             )
             return (None, None)
 
-        encoded_text = quote(message, safe="")
-        url = f"{self._base_url}/synthesize/{encoded_text}"
+        url = self._synth_prefix + _encode_message(message)
 
         # Create aiohttp session lazily inside the coroutine where a loop is present
         session = async_get_clientsession(self._hass)
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self._max_concurrent)
 
         try:
-            async with session.get(
-                url,
-                timeout=ClientTimeout(total=self._timeout),
-                headers={"Accept": "audio/mpeg"},
-            ) as resp:
-                if resp.status != 200:
-                    text = await resp.text()
-                    _LOGGER.error(
-                        "TTS HTTP %s at %s in ha_tts_adapter: %s",
-                        resp.status,
-                        url,
-                        text[:256],
-                    )
-                    return (None, None)
-                data = await resp.read()
-                if not data:
-                    _LOGGER.error(
-                        "TTS empty audio at %s in ha_tts_adapter: zero-length response",
+            # Bound semaphore wait + request together so queued calls still honor the configured timeout
+            async with asyncio.timeout(self._timeout):
+                async with self._sem:
+                    async with session.get(
                         url,
-                    )
-                    return (None, None)
-                return (self._format, data)
+                        timeout=self._aio_timeout,
+                        headers=self._aio_headers,
+                    ) as resp:
+                        if resp.status != 200:
+                            text = await resp.text()
+                            _LOGGER.error(
+                                "TTS HTTP %s at %s in ha_tts_adapter: %s",
+                                resp.status,
+                                url,
+                                text[:256],
+                            )
+                            return (None, None)
+                        data = await resp.read()
+                        if not data:
+                            _LOGGER.error(
+                                "TTS empty audio at %s in ha_tts_adapter: zero-length response",
+                                url,
+                            )
+                            return (None, None)
+                        return (self._format, data)
+        except TimeoutError:
+            _LOGGER.error(
+                "TTS timeout at %s in ha_tts_adapter: exceeded %s seconds",
+                self._base_url,
+                self._timeout,
+            )
+            return (None, None)
         except Exception as exc:
             _LOGGER.error(
                 "TTS request failure at %s in ha_tts_adapter: %s",
@@ -139,9 +184,8 @@ class HaTtsAdapterProvider(Provider):
             return (None, None)
 
         try:
-            encoded_text = quote(message, safe="")
-            url = f"{self._base_url}/synthesize/{encoded_text}"
-            response = requests.get(url, timeout=self._timeout, headers={"Accept": "audio/mpeg"})
+            url = self._synth_prefix + _encode_message(message)
+            response = self._session.get(url, timeout=self._timeout)
 
             if response.status_code != 200:
                 _LOGGER.error(
@@ -9,16 +9,26 @@
 # pylance: disable=reportMissingImports, reportMissingModuleSource
 # mypy: disable-error-code="import-untyped, import-not-found, attr-defined"
 
-import urllib.parse
-import subprocess
 import tempfile
 import os
+import re
 import time
-from flask import Flask, request, Response
+import hashlib
+import functools
+import threading
+from collections import OrderedDict
+from flask import Flask, request, Response, stream_with_context
 from TeraTTS import TTS
 from ruaccent import RUAccent
+import numpy as np
+import onnxruntime
+import lameenc
 import logging
 import dotenv
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
 
 logger = logging.getLogger(__name__)
 
@@ -34,108 +44,363 @@ logging.basicConfig(
 
 # Suppress HuggingFace tokenizers parallelism warnings
 os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
-logging.info("INFO: TOKENIZERS_PARALLELISM=false (suppress tokenizer parallelism warnings)")
+logger.info("INFO: TOKENIZERS_PARALLELISM=false (suppress tokenizer parallelism warnings)")
 
-logging.info("INFO: Initializing TTS Engine (TeraTTS GLaDOS2)...")
+logger.info("INFO: Initializing TTS Engine (TeraTTS GLaDOS2)...")
 
 accentizer = RUAccent()
 try:
     accentizer.load(omograph_model_size="turbo", use_dictionary=True)
-    logging.info("INFO: RUAccent models loaded: omograph_model_size=turbo, use_dictionary=True")
+    logger.info("INFO: RUAccent models loaded: omograph_model_size=turbo, use_dictionary=True")
 except Exception as e:
-    logging.info(f"RUAccent initialization error: {str(e)}")
+    logger.warning("RUAccent initialization error: %s", e)
 
 try:
     MODEL_PATH = os.getenv("MODEL_PATH", "TeraTTS/glados2-g2p-vits")
     tts = TTS(MODEL_PATH, add_time_to_end=0.5, tokenizer_load_dict=False)
-    logging.info(f"INFO: TTS model loaded from {MODEL_PATH}")
+    logger.info("INFO: TTS model loaded from %s", MODEL_PATH)
 except Exception as e:
     raise RuntimeError(f"TTS model initialization error from {MODEL_PATH}: {str(e)}")
 
+# TeraTTS runs its VITS model through onnxruntime (no autograd to disable); rebuild the
+# session with full graph optimizations and an explicit thread budget
+ORT_THREADS = int(os.getenv("ORT_THREADS", str(os.cpu_count() or 2)))
+
+def _ort_session(model_path: str, providers) -> onnxruntime.InferenceSession:
+    opts = onnxruntime.SessionOptions()
+    opts.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    opts.intra_op_num_threads = ORT_THREADS
+    opts.inter_op_num_threads = 1
+    return onnxruntime.InferenceSession(model_path, opts, providers=providers)
+
+# Run on CUDA when onnxruntime-gpu is installed and a GPU is usable (TTS_DEVICE=auto|cuda|cpu)
+TTS_DEVICE = os.getenv("TTS_DEVICE", "auto").lower()
+
+def _select_providers(default_providers):
+    if TTS_DEVICE != "cpu" and "CUDAExecutionProvider" in onnxruntime.get_available_providers():
+        return ["CUDAExecutionProvider", "CPUExecutionProvider"]
+    if TTS_DEVICE == "cuda":
+        logger.warning("CUDAExecutionProvider not available in onnxruntime; falling back to CPU")
+    return default_providers
+
+try:
+    ONNX_MODEL_PATH = tts.model._model_path
+    tts.model = _ort_session(ONNX_MODEL_PATH, _select_providers(tts.model.get_providers()))
+    logger.info("INFO: onnxruntime session tuned: threads=%d, providers=%s", ORT_THREADS, tts.model.get_providers())
+except Exception as e:
+    ONNX_MODEL_PATH = None
+    logger.warning("onnxruntime session tuning error: %s; keeping default session", e)
+
+# Optional int8 dynamic quantization of the ONNX model (weights only), verified against FP32 output
+QUANT_MODE = "fp32"
+if os.getenv("TTS_QUANT", "0") == "1" and ONNX_MODEL_PATH:
+    fp32_model = tts.model
+    try:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quant_path = os.path.splitext(ONNX_MODEL_PATH)[0] + ".int8.onnx"
+        if not os.path.exists(quant_path):
+            # Quantize into a temp file and rename, so a crash never leaves a truncated model behind
+            fd, quant_tmp_path = tempfile.mkstemp(dir=os.path.dirname(quant_path), suffix='.onnx.tmp')
+            os.close(fd)
+            try:
+                quantize_dynamic(ONNX_MODEL_PATH, quant_tmp_path, weight_type=QuantType.QInt8)
+                os.replace(quant_tmp_path, quant_path)
+            finally:
+                if os.path.exists(quant_tmp_path):
+                    os.unlink(quant_tmp_path)
+        reference = np.asarray(tts("проверка", lenght_scale=2), dtype=np.float32)
+        tts.model = _ort_session(quant_path, fp32_model.get_providers())
+        candidate = np.asarray(tts("проверка", lenght_scale=2), dtype=np.float32)
+        if candidate.size == 0 or not np.isfinite(candidate).all() or abs(candidate.size - reference.size) > reference.size * 0.1:
+            tts.model = fp32_model
+            logger.warning("INT8 model output check failed (samples %d vs %d); keeping FP32", candidate.size, reference.size)
+        else:
+            QUANT_MODE = "int8"
+            logger.info("INFO: INT8 quantized model loaded from %s", quant_path)
+    except Exception as e:
+        tts.model = fp32_model
+        logger.warning("INT8 quantization error: %s; keeping FP32", e)
+
+# TeraTTS writes WAVs at 22050 Hz by default (see TTS.save_wav)
+SAMPLE_RATE = int(getattr(tts, "sample_rate", 22050))
+
+# MP3 encoder settings; LAME encoders are stateful, so each stream gets its own instance
+MP3_BITRATE = int(os.getenv("MP3_BITRATE", "96"))
+MP3_QUALITY = 2
+
+def new_mp3_encoder() -> lameenc.Encoder:
+    encoder = lameenc.Encoder()
+    encoder.set_bit_rate(MP3_BITRATE)
+    encoder.set_in_sample_rate(SAMPLE_RATE)
+    encoder.set_channels(1)
+    encoder.set_quality(MP3_QUALITY)
+    return encoder
+
+# On-disk MP3 cache keyed by model + processed text, bounded by entry count (LRU)
+CACHE_DIR = os.getenv("TTS_CACHE_DIR", "/tmp/tts_cache")
+CACHE_MAX_ENTRIES = int(os.getenv("TTS_CACHE_MAX_ENTRIES", "512"))
+LENGTH_SCALE = 2
+# Bump when the stored audio format changes so stale files (and ETags) are never reused
+CACHE_FORMAT_VERSION = 2
+os.makedirs(CACHE_DIR, exist_ok=True)
+_cache_lock = threading.Lock()
+_cache_index: "OrderedDict[str, str]" = OrderedDict()
+_cache_files = []
+for _name in os.listdir(CACHE_DIR):
+    _path = os.path.join(CACHE_DIR, _name)
+    try:
+        _cache_files.append((os.path.getmtime(_path), _name, _path))
+    except OSError:
+        # Removed between listdir and stat (e.g. shared cache volume)
+        continue
+for _, _name, _path in sorted(_cache_files):
+    if _name.endswith('.mp3'):
+        _cache_index[_name[:-4]] = _path
+    elif _name.endswith('.tmp'):
+        # Leftover from a cache_put interrupted before os.replace
+        try:
+            os.unlink(_path)
+        except OSError:
+            pass
+# Apply a lowered TTS_CACHE_MAX_ENTRIES right away, dropping the oldest files first
+while len(_cache_index) > max(CACHE_MAX_ENTRIES, 0):
+    try:
+        os.unlink(_cache_index.popitem(last=False)[1])
+    except OSError:
+        pass
+logger.info("INFO: MP3 cache at %s: %d entries, max=%d", CACHE_DIR, len(_cache_index), CACHE_MAX_ENTRIES)
+
+def cache_key(processed_text: str) -> str:
+    # Everything that changes the output bytes: format version, model + quantization, synthesis and encoder settings
+    data = (
+        f"{CACHE_FORMAT_VERSION}|{MODEL_PATH}|{QUANT_MODE}|{LENGTH_SCALE}|"
+        f"{SAMPLE_RATE}|{MP3_BITRATE}|{MP3_QUALITY}|{processed_text}"
+    ).encode("utf-8")
+    if xxhash is not None:
+        return xxhash.xxh3_128_hexdigest(data)
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def cache_get(key: str):
+    """Return cached MP3 bytes for key, or None on miss."""
+    with _cache_lock:
+        path = _cache_index.get(key)
+        if path is None: return None
+        _cache_index.move_to_end(key)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        # Touch on hit so the mtime-based LRU order rebuilt at startup reflects reads too
+        os.utime(path)
+        return data
+    except OSError:
+        with _cache_lock:
+            _cache_index.pop(key, None)
+        return None
+
+def cache_put(key: str, audio_data: bytes) -> None:
+    """Store MP3 bytes atomically and evict least recently used entries over the limit."""
+    if CACHE_MAX_ENTRIES <= 0: return
+    path = os.path.join(CACHE_DIR, f"{key}.mp3")
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(audio_data)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning("MP3 cache write error: %s", e)
+        return
+    with _cache_lock:
+        _cache_index[key] = path
+        _cache_index.move_to_end(key)
+        evicted = []
+        while len(_cache_index) > CACHE_MAX_ENTRIES:
+            evicted.append(_cache_index.popitem(last=False)[1])
+    for old_path in evicted:
+        try:
+            os.unlink(old_path)
+        except OSError:
+            pass
+
+# RUAccent is not thread-safe: serialize its calls across server threads (independent of _MODEL_LOCK)
+_ACCENT_LOCK = threading.Lock()
+
+@functools.lru_cache(maxsize=int(os.getenv("ACCENT_CACHE_SIZE", "1024")))
+def _accentize(raw_text: str) -> str:
+    # Exceptions are not cached by lru_cache, so failed lookups are retried next time
+    with _ACCENT_LOCK:
+        return accentizer.process_all(raw_text)
+
 def preprocess_text(raw_text: str) -> str:
     """Apply accentization and text normalization for better synthesis quality."""
     try:
-        return accentizer.process_all(raw_text)
+        return _accentize(raw_text)
     except Exception as e:
-        logging.info(f"RUAccent processing error: {str(e)}; fallback to raw text")
+        logger.warning("RUAccent processing error: %s; fallback to raw text", e)
         return raw_text
 
+# One-shot warmup so the first real request does not pay model/session initialization cost;
+# preprocess_text falls back to raw text, so TeraTTS still warms up if RUAccent failed to load
+if os.getenv("TTS_WARMUP", "1") == "1":
+    warmup_start = time.perf_counter()
+    try:
+        _ = tts(preprocess_text("прогрев"), lenght_scale=LENGTH_SCALE)
+        logger.info("INFO: warmup ok; duration=%.0f ms", (time.perf_counter() - warmup_start)*1000)
+    except Exception as e:
+        logger.warning("Warmup error: %s", e)
+
+# Same URL + ETag always carries the same caching policy (304, cache hit, fresh synthesis)
+CACHE_CONTROL = 'public, max-age=86400'
+
+# PCM bytes encoded per streamed chunk (~0.37 s at 22050 Hz mono s16le)
+STREAM_CHUNK_SIZE = 16384
+
+# The TTS model is not reentrant: serialize inference, bound the number of queued requests.
+# MAX_QUEUE must stay below SERVER_THREADS so a free thread is left to answer overload with 503
+# (and serve cache hits) instead of letting requests pile up inside waitress
+_MODEL_LOCK = threading.Lock()
+SERVER_THREADS = max(1, int(os.getenv("SERVER_THREADS", "4")))
+_max_queue_limit = max(1, SERVER_THREADS - 1)
+MAX_QUEUE = int(os.getenv("MAX_QUEUE", str(_max_queue_limit)))
+if not 1 <= MAX_QUEUE <= _max_queue_limit:
+    logger.warning(
+        "MAX_QUEUE=%d out of range [1, %d] for SERVER_THREADS=%d; using %d",
+        MAX_QUEUE, _max_queue_limit, SERVER_THREADS, min(max(MAX_QUEUE, 1), _max_queue_limit),
+    )
+    MAX_QUEUE = min(max(MAX_QUEUE, 1), _max_queue_limit)
+if SERVER_THREADS == 1:
+    logger.warning("SERVER_THREADS=1 leaves no spare thread: overload queues inside waitress instead of getting 503")
+_inflight = threading.Semaphore(MAX_QUEUE)
+
+def to_pcm16(audio) -> np.ndarray:
+    """Convert TTS output to mono little-endian int16 PCM, clipping samples so they cannot wrap."""
+    audio = np.asarray(audio).reshape(-1)
+    if np.issubdtype(audio.dtype, np.integer):
+        return np.clip(audio, -32768, 32767).astype('<i2', copy=False)
+    return (np.clip(audio, -1.0, 1.0) * 32767).astype('<i2')
+
+# Manual corrections for known accentizer mistakes, applied as a single regex pass
+_FIXUPS = {
+    "Не шм+огла": "Не шмогл+а",
+}
+_FIXUPS_RE = re.compile("|".join(map(re.escape, _FIXUPS)))
+
+def apply_fixups(processed_text: str) -> str:
+    return _FIXUPS_RE.sub(lambda m: _FIXUPS[m.group(0)], processed_text)
+
 app = Flask(__name__)
 
+@app.route('/cache/clear', methods=['POST'])
+def cache_clear():
+    _accentize.cache_clear()
+    with _cache_lock:
+        paths = list(_cache_index.values())
+        _cache_index.clear()
+    for path in paths:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+    logger.info("INFO: caches cleared: accent, mp3 (%d files)", len(paths))
+    return 'OK', 200
+
 @app.route('/synthesize/', defaults={'text': ''})
 @app.route('/synthesize/<path:text>')
 def synthesize(text):
     if text == '': return 'No input', 400
 
     request_start = time.perf_counter()
-    line = urllib.parse.unquote(request.url[request.url.find('synthesize/') + 11:])
+    line = text  # <path:text> is already percent-decoded by Werkzeug
     
     try:
         accent_start = time.perf_counter()
         processed_text = preprocess_text(line)
         accent_duration = (time.perf_counter() - accent_start)*1000
-        logging.info(f"synthesize: stage=accent; duration={accent_duration:.0f} ms")
-        logging.info(f"Processed text: {processed_text}")
-        if processed_text == "Не шм+огла": processed_text = "Не шмогл+а"
+        logger.info("synthesize: stage=%s; duration=%.0f ms", "accent", accent_duration)
+        logger.debug("Processed text: %s", processed_text)
+        processed_text = apply_fixups(processed_text)
         text_len = len(processed_text)
 
-        tts_start = time.perf_counter()
-        audio = tts(processed_text, lenght_scale=2)
-        tts_duration = (time.perf_counter() - tts_start)*1000
-        logging.info(f"synthesize: stage=tts; duration={tts_duration:.0f} ms")
-        
-        # Create temporary files for WAV and MP3
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as wav_file:
-            wav_path = wav_file.name
-        
+        key = cache_key(processed_text)
+        # The cache key identifies model + settings + processed text, so it doubles as an ETag. It is weak:
+        # VITS synthesis is stochastic, so re-synthesizing after eviction yields different bytes.
+        # If-None-Match uses weak comparison (RFC 9110 section 13.1.2)
+        etag = f'W/"{key}"'
+        if request.if_none_match.contains_weak(key):
+            logger.info("synthesize: not modified; total=%.3f s", time.perf_counter() - request_start)
+            return Response(status=304, headers={'ETag': etag, 'Cache-Control': CACHE_CONTROL})
+        cached = cache_get(key)
+        if cached is not None:
+            logger.info("synthesize: cache hit; total=%.3f s", time.perf_counter() - request_start)
+            return Response(
+                cached,
+                mimetype='audio/mpeg',
+                direct_passthrough=True,
+                headers={
+                    'Content-Disposition': 'inline; filename="glados.mp3"',
+                    'Content-Length': str(len(cached)),
+                    'Cache-Control': CACHE_CONTROL,
+                    'ETag': etag,
+                }
+            )
+
+        # Admission control: reject when too many synthesis requests are already waiting on the model
+        if not _inflight.acquire(blocking=False):
+            logger.warning("synthesize: rejected; queue full (max=%d)", MAX_QUEUE)
+            return 'TTS server busy', 503
         try:
-            # Save WAV
-            save_start = time.perf_counter()
-            tts.save_wav(audio, wav_path)
-            save_duration = time.perf_counter() - save_start
-            logging.info(f"synthesize: stage=save_wav; duration={save_duration:.0f} ms")
-
-            # Convert WAV → MP3 via FFmpeg
-            mp3_path = wav_path.replace('.wav', '.mp3')
-            cmd = [ 'ffmpeg', '-y', '-i', wav_path, '-codec:a', 'libmp3lame', '-q:a', '2', mp3_path ]
-            ffmpeg_start = time.perf_counter()
-            subprocess.run(cmd, check=True, capture_output=True)
-            ffmpeg_duration = (time.perf_counter() - ffmpeg_start)*1000
-            logging.info(f"synthesize: stage=ffmpeg; duration={ffmpeg_duration:.0f} ms")
-            
-            # Read MP3 and return
-            with open(mp3_path, 'rb') as f:
-                audio_data = f.read()
-                
+            tts_start = time.perf_counter()
+            with _MODEL_LOCK:
+                audio = tts(processed_text, lenght_scale=LENGTH_SCALE)
         finally:
-            # Cleanup temporary files
-            if os.path.exists(wav_path):
-                os.unlink(wav_path)
-            if os.path.exists(mp3_path):
-                os.unlink(mp3_path)
+            _inflight.release()
+        tts_duration = (time.perf_counter() - tts_start)*1000
+        logger.info("synthesize: stage=%s; duration=%.0f ms", "tts", tts_duration)
         
-        response = Response(
-            audio_data,
+        # Convert float audio to 16-bit PCM and encode to MP3 in-process (no ffmpeg fork, no temp files)
+        pcm_bytes = to_pcm16(audio).tobytes()
+        encoder = new_mp3_encoder()
+        encode_start = time.perf_counter()
+
+        def generate():
+            # Stream MP3 frames as PCM blocks are encoded; tee into the cache only if the whole stream was sent
+            chunks = []
+            completed = False
+            try:
+                for offset in range(0, len(pcm_bytes), STREAM_CHUNK_SIZE):
+                    chunk = bytes(encoder.encode(pcm_bytes[offset:offset + STREAM_CHUNK_SIZE]))
+                    if chunk:
+                        chunks.append(chunk)
+                        yield chunk
+                chunk = bytes(encoder.flush())
+                if chunk:
+                    chunks.append(chunk)
+                    yield chunk
+                completed = True
+            finally:
+                encode_duration = (time.perf_counter() - encode_start)*1000
+                logger.info("synthesize: stage=%s; duration=%.0f ms", "mp3", encode_duration)
+                if completed:
+                    cache_put(key, b''.join(chunks))
+                    total_duration = time.perf_counter() - request_start
+                    total_per_char = total_duration / max(text_len, 1) * 1000
+                    logger.info(
+                        "synthesize: total=%.3f s; char=%.0f ms", total_duration, total_per_char
+                    )
+
+        return Response(
+            stream_with_context(generate()),
             mimetype='audio/mpeg',
-            headers={'Content-Disposition': 'inline; filename="glados.mp3"'}
-        )
-        total_duration = time.perf_counter() - request_start
-        total_per_char = total_duration / max(text_len, 1) * 1000
-        logging.info(
-            f"synthesize: total={total_duration:.3f} s; char={total_per_char:.0f} ms"
+            headers={
+                'Content-Disposition': 'inline; filename="glados.mp3"',
+                'Cache-Control': CACHE_CONTROL,
+                'ETag': etag,
+            }
         )
-        return response
         
-    except subprocess.CalledProcessError as e:
-        return f"FFmpeg conversion error: {str(e)}", 500
     except Exception as e:
         return f"TTS synthesis error: {str(e)}", 500
 
 if __name__ == "__main__":
-    logging.info("INFO: Initializing TTS Server (Flask)...")
-    # Hide default Flask banner
-    import sys as _sys
-    cli = _sys.modules.get('flask.cli')
-    if cli is not None:
-        cli.show_server_banner = lambda *x: None
-    app.run(host="0.0.0.0", port=int(os.getenv("PORT", "8124")))
+    from waitress import serve
+    logger.info("INFO: Initializing TTS Server (waitress)...")
+    serve(app, host="0.0.0.0", port=int(os.getenv("PORT", "8124")), threads=SERVER_THREADS)